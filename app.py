@@ -1,15 +1,32 @@
+import eventlet
+eventlet.monkey_patch()
+
 import os
+import atexit
+import collections
+import fcntl
+import threading
+import time
+import weakref
 from datetime import datetime
+from functools import lru_cache
+from eventlet import tpool
 from flask import Flask, render_template, request, jsonify
-from flask_socketio import emit, join_room
-import json
+from flask_socketio import emit, join_room, rooms
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError, OperationalError
 import logging
+import orjson
+import redis
+import sqlite3
 
 from extensions import db, socketio
 from cache_manager import (
-    cache, check_redis_connection, cache_room_state,
-    track_user_presence, get_active_users, prefetch_room_data,
-    cache_cursor_position  # Add cursor position caching
+    cache, tracked_read, check_redis_connection, record_room_join, prefetch_room_data,
+    cache_cursor_positions, index_room_key, cleanup_inactive_rooms,
+    get_active_users, remove_user_presence, refresh_user_presence,
+    PRESENCE_CLEANUP_INTERVAL
 )
 
 # Configure logging
@@ -18,20 +35,392 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.urandom(24)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///whiteboard.db'
+# Whiteboard data is ephemeral and mirrored in Redis, so SQLite runs in a
+# shared in-memory database that is periodically snapshotted to disk
+MEMORY_DB_URI = 'file:/whiteboard?mode=memory&cache=shared'  # Absolute so Flask-SQLAlchemy leaves it as is
+DB_SNAPSHOT_PATH = os.environ.get('DB_SNAPSHOT_PATH', os.path.join(app.instance_path, 'whiteboard.db'))
+DB_SNAPSHOT_INTERVAL = 30  # seconds
+# Cap on the in-memory database, well under the pods' 256Mi memory limit
+DB_MAX_BYTES = int(os.environ.get('DB_MAX_BYTES', 64 * 1024 * 1024))
+DB_PRUNE_BATCH = 1000  # Oldest drawings dropped per step while over DB_MAX_BYTES
+app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{MEMORY_DB_URI}&uri=true'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Keeps the in-memory database alive for the process and is the snapshot source
+memory_db = sqlite3.connect(MEMORY_DB_URI, uri=True, check_same_thread=False)
+
 # Initialize extensions
 db.init_app(app)
 socketio.init_app(app)
 
+@event.listens_for(Engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Enable WAL and tune SQLite for concurrent readers and frequent small writes"""
+    # Only file-backed sqlite3 connections support WAL
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    database = dbapi_connection.execute("PRAGMA database_list").fetchone()[2]
+    if not database or database == ':memory:':
+        return
+
+    cursor = dbapi_connection.cursor()
+    # auto_vacuum must be set before journal_mode to apply to a new database
+    cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")  # 256 MB
+    cursor.execute("PRAGMA wal_autocheckpoint=1000")
+    cursor.close()
+
 # Import models after db initialization
 import models
 
+def restore_db_snapshot():
+    """Load the last on-disk snapshot into the in-memory database"""
+    if not os.path.exists(DB_SNAPSHOT_PATH):
+        return
+    snapshot = sqlite3.connect(DB_SNAPSHOT_PATH)
+    try:
+        snapshot.backup(memory_db)
+        logger.info(f"Restored database snapshot from {DB_SNAPSHOT_PATH}")
+    finally:
+        snapshot.close()
+
+def upgrade_legacy_drawings(batch_size=500):
+    """Re-encode drawings stored as JSON text by older versions as msgpack
+
+    Snapshots written before paths were stored as msgpack hold Text rows and
+    lack the room/created_at index; both are fixed in place once on startup.
+    """
+    for index in models.DrawingData.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
+
+    table = models.DrawingData.__tablename__
+    select_legacy = db.text(
+        f"SELECT id, data FROM {table} WHERE typeof(data) = 'text' AND id > :last_id "
+        "ORDER BY id LIMIT :limit"
+    )
+    update_data = db.text(f"UPDATE {table} SET data = :data WHERE id = :id")
+    last_id = converted = 0
+    while True:
+        rows = db.session.execute(select_legacy, {'last_id': last_id, 'limit': batch_size}).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        updates = []
+        for row in rows:
+            try:
+                updates.append({'id': row.id, 'data': models.pack_path(orjson.loads(row.data))})
+            except orjson.JSONDecodeError as e:
+                logger.error(f"Leaving undecodable legacy drawing {row.id}: {e}")
+        if updates:
+            db.session.execute(update_data, updates)
+            db.session.commit()
+            converted += len(updates)
+    if converted:
+        logger.info(f"Converted {converted} legacy drawings to msgpack")
+
+
+# Draw write-coalescing: strokes are queued and persisted in batches
+DRAW_FLUSH_INTERVAL = 0.05  # 50ms
+DRAW_BATCH_SIZE = 500
+DRAW_QUEUE_LIMIT = 10000    # Flush inline beyond this to bound memory
+draw_queue = collections.deque()
+draw_queue_lock = threading.Lock()
+draw_flush_lock = threading.Lock()  # Serializes DB writes with room clears and snapshots
+# Per-room locks ordering cached list refills against stroke appends; entries
+# go away once no handler holds them
+room_cache_locks = weakref.WeakValueDictionary()
+
+# Cursor coalescing: only the latest position per (room, sid) is kept per tick
+CURSOR_FLUSH_INTERVAL = 0.05  # 50ms, at most 20 updates/s per user
+cursor_buffer = {}
+cursor_buffer_lock = threading.Lock()
+
+# Redis status served by /health, refreshed by a background prober
+REDIS_HEALTH_INTERVAL = 5  # seconds
+redis_health = {'ok': False, 'checked_at': 0}
+
+# Sids joined to each room on this worker, tracked from join/disconnect
+local_room_sids = collections.defaultdict(set)
+
+_background_tasks = set()
+_background_tasks_lock = threading.Lock()
+
+def start_background_once(target):
+    """Start a socketio background task once per process"""
+    with _background_tasks_lock:
+        if target in _background_tasks:
+            return
+        _background_tasks.add(target)
+    socketio.start_background_task(target)
+
+def requeue_drawings(rows):
+    """Put unpersisted drawings back at the front of the queue, keeping their order"""
+    with draw_queue_lock:
+        draw_queue.extendleft(reversed(rows))
+
+def room_cache_lock(room_id):
+    """Return the lock guarding a room's cached drawing list
+
+    Lock order is room_cache_lock -> draw_flush_lock -> draw_queue_lock.
+    """
+    return room_cache_locks.setdefault(room_id, threading.Lock())
+
+def flush_draw_queue():
+    """Persist up to DRAW_BATCH_SIZE queued drawings in a single transaction
+
+    Returns the number of drawings taken off the queue, or 0 when a transient
+    database error (e.g. a locked database) put the batch back for a retry.
+    """
+    with draw_flush_lock:
+        with draw_queue_lock:
+            batch = [draw_queue.popleft() for _ in range(min(len(draw_queue), DRAW_BATCH_SIZE))]
+        if not batch:
+            return 0
+
+        with app.app_context():
+            try:
+                db.session.bulk_insert_mappings(models.DrawingData, batch)
+                db.session.commit()
+            except OperationalError as e:
+                db.session.rollback()
+                logger.warning(f"Batch insert of {len(batch)} drawings failed, will retry: {e}")
+                requeue_drawings(batch)
+                return 0
+            except Exception as e:
+                db.session.rollback()
+                logger.warning(f"Batch insert of {len(batch)} drawings failed, retrying per row: {e}")
+                # Isolate the bad rows so other rooms' strokes still persist
+                for i, row in enumerate(batch):
+                    try:
+                        db.session.bulk_insert_mappings(models.DrawingData, [row])
+                        db.session.commit()
+                    except OperationalError as e:
+                        db.session.rollback()
+                        logger.warning(f"Per-row insert failed, will retry {len(batch) - i} drawings: {e}")
+                        requeue_drawings(batch[i:])
+                        return 0
+                    except Exception as e:
+                        db.session.rollback()
+                        logger.error(f"Dropping drawing for room {row['room_id']!r}: {e}")
+        return len(batch)
+
+def draw_flush_worker():
+    """Background task draining the draw queue every DRAW_FLUSH_INTERVAL"""
+    while True:
+        socketio.sleep(DRAW_FLUSH_INTERVAL)
+        try:
+            while flush_draw_queue() == DRAW_BATCH_SIZE:
+                pass
+        except Exception as e:
+            logger.error(f"Error flushing drawings: {e}")
+
+def flush_cursor_buffer():
+    """Cache and broadcast the latest buffered cursor positions"""
+    with cursor_buffer_lock:
+        if not cursor_buffer:
+            return
+        pending = cursor_buffer.copy()
+        cursor_buffer.clear()
+
+    cache_cursor_positions(pending)
+    for (room, sid), cursor_data in pending.items():
+        # Sent as positional (userName, x, y) arguments, shorter than a dict
+        socketio.emit('cursor_update', (
+            cursor_data['userName'],
+            cursor_data['x'],
+            cursor_data['y']
+        ), to=room, skip_sid=sid)
+
+def cursor_flush_worker():
+    """Background task flushing coalesced cursor moves every CURSOR_FLUSH_INTERVAL"""
+    while True:
+        socketio.sleep(CURSOR_FLUSH_INTERVAL)
+        try:
+            flush_cursor_buffer()
+        except Exception as e:
+            logger.error(f"Error flushing cursor positions: {e}")
+
+def presence_cleanup_worker():
+    """Background task refreshing local users' presence and removing stale entries"""
+    while True:
+        socketio.sleep(PRESENCE_CLEANUP_INTERVAL)
+        # Heartbeat users connected to this worker so sweeps only drop users
+        # whose worker went away without a disconnect
+        for room, sids in list(local_room_sids.items()):
+            refresh_user_presence(room, list(sids))
+        cleanup_inactive_rooms()
+
+def refresh_redis_health():
+    """Probe Redis and cache the result for health checks"""
+    redis_health['ok'] = check_redis_connection()
+    redis_health['checked_at'] = time.time()
+
+def redis_health_worker():
+    """Background task refreshing the cached Redis status every REDIS_HEALTH_INTERVAL"""
+    while True:
+        socketio.sleep(REDIS_HEALTH_INTERVAL)
+        refresh_redis_health()
+
+def claim_snapshot_path():
+    """Lock DB_SNAPSHOT_PATH for this process, refusing to serve if it's taken
+
+    Each process has its own in-memory database, so a second worker sharing
+    the path would overwrite the other's snapshots and miss its clears.
+    """
+    global _snapshot_lock_file
+    os.makedirs(os.path.dirname(DB_SNAPSHOT_PATH) or '.', exist_ok=True)
+    lock_file = open(f"{DB_SNAPSHOT_PATH}.lock", 'w')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        raise RuntimeError(
+            f"{DB_SNAPSHOT_PATH} is in use by another process; the in-memory "
+            "database needs a single worker or a DB_SNAPSHOT_PATH per worker"
+        )
+    _snapshot_lock_file = lock_file  # Held open for the life of the process
+
+def db_used_bytes():
+    """Size of the in-memory database's pages in use, excluding free pages"""
+    page_size = memory_db.execute("PRAGMA page_size").fetchone()[0]
+    page_count = memory_db.execute("PRAGMA page_count").fetchone()[0]
+    free_pages = memory_db.execute("PRAGMA freelist_count").fetchone()[0]
+    return (page_count - free_pages) * page_size
+
+def prune_db():
+    """Bound the in-memory database; callers hold draw_flush_lock
+
+    Drawings older than a room's latest MAX_ROOM_DRAWINGS are never loaded and
+    are dropped. While the database still exceeds DB_MAX_BYTES, the oldest
+    drawings overall are dropped and their rooms' cached lists invalidated.
+    """
+    drawing = models.DrawingData
+    with app.app_context():
+        ranked = db.select(
+            drawing.id,
+            db.func.row_number().over(
+                partition_by=drawing.room_id,
+                order_by=(drawing.created_at.desc(), drawing.id.desc())
+            ).label('n')
+        ).subquery()
+        hidden = db.select(ranked.c.id).where(ranked.c.n > models.MAX_ROOM_DRAWINGS)
+        pruned = db.session.execute(
+            db.delete(drawing).where(drawing.id.in_(hidden)),
+            execution_options={'synchronize_session': False}
+        ).rowcount
+        db.session.commit()
+
+        evicted_rooms = set()
+        oldest = db.select(drawing.id, drawing.room_id).order_by(drawing.created_at, drawing.id)
+        while db_used_bytes() > DB_MAX_BYTES:
+            rows = db.session.execute(oldest.limit(DB_PRUNE_BATCH)).all()
+            if not rows:
+                break
+            db.session.execute(
+                db.delete(drawing).where(drawing.id.in_([row.id for row in rows])),
+                execution_options={'synchronize_session': False}
+            )
+            db.session.commit()
+            pruned += len(rows)
+            evicted_rooms.update(row.room_id for row in rows)
+
+    if evicted_rooms:
+        logger.warning(f"Database over {DB_MAX_BYTES} bytes, dropped oldest drawings from {len(evicted_rooms)} rooms")
+        try:
+            cache.delete(*(f"drawing_list:{room_id}" for room_id in evicted_rooms))
+        except redis.RedisError as e:
+            logger.error(f"Failed to invalidate pruned rooms' drawing caches: {e}")
+    if pruned:
+        logger.info(f"Pruned {pruned} drawings from the database")
+
+def _backup_to_disk():
+    """Copy the in-memory database to DB_SNAPSHOT_PATH (runs in a native thread)"""
+    os.makedirs(os.path.dirname(DB_SNAPSHOT_PATH) or '.', exist_ok=True)
+    target = sqlite3.connect(DB_SNAPSHOT_PATH)
+    try:
+        target.execute("PRAGMA journal_mode=WAL")
+        memory_db.backup(target)
+    finally:
+        target.close()
+
+def db_data_version():
+    """SQLite's data_version, which changes whenever another connection commits"""
+    return memory_db.execute("PRAGMA data_version").fetchone()[0]
+
+def snapshot_db():
+    """Prune and snapshot the in-memory database if it changed since the last snapshot"""
+    global _snapshot_version
+    try:
+        # Keep DB writes from hitting shared-cache locks mid-backup
+        with draw_flush_lock:
+            if db_data_version() == _snapshot_version:
+                return
+            prune_db()
+            version = db_data_version()
+            # Copy off the eventlet hub so sockets keep being served
+            tpool.execute(_backup_to_disk)
+            _snapshot_version = version
+    except Exception as e:
+        logger.error(f"Failed to snapshot database: {e}")
+
+def db_snapshot_worker():
+    """Background task snapshotting the database every DB_SNAPSHOT_INTERVAL"""
+    while True:
+        socketio.sleep(DB_SNAPSHOT_INTERVAL)
+        snapshot_db()
+
+_db_ready = False
+_db_ready_lock = threading.Lock()
+_snapshot_lock_file = None
+_snapshot_version = None  # data_version as of the last snapshot
+
+@app.before_request
+def ensure_db_ready():
+    """Restore the last snapshot and start snapshotting on first use
+
+    Runs lazily so a process that imports the app without serving it (such
+    as the werkzeug reloader's watcher) never restores or writes snapshots.
+    """
+    global _db_ready
+    if _db_ready:
+        return
+    with _db_ready_lock:
+        if _db_ready:
+            return
+        claim_snapshot_path()
+        restore_db_snapshot()
+        with app.app_context():
+            db.create_all()
+            upgrade_legacy_drawings()
+        with draw_flush_lock:
+            prune_db()  # A snapshot from before the size cap may be over it
+        _db_ready = True
+    start_background_once(db_snapshot_worker)
+
+def final_snapshot():
+    """Snapshot once more at exit if this process served the database"""
+    if _db_ready:
+        snapshot_db()
+
+# Registered before drain_draw_queue so it runs after it at exit
+atexit.register(final_snapshot)
+
+@atexit.register
+def drain_draw_queue():
+    """Flush any pending drawings on shutdown"""
+    while flush_draw_queue():
+        pass
+
 @app.route('/health')
 def health_check():
     """Health check endpoint for k8s and monitoring"""
-    redis_status = check_redis_connection()
+    if not redis_health['checked_at']:
+        refresh_redis_health()  # Nothing cached before the prober's first run
+    start_background_once(redis_health_worker)
+    redis_status = redis_health['ok']
     return jsonify({
         'status': 'healthy' if redis_status else 'degraded',
         'redis': 'connected' if redis_status else 'disconnected',
@@ -42,43 +431,87 @@ def health_check():
 def index():
     return render_template('index.html')
 
+@lru_cache(maxsize=4096)
+def ensure_room(room_id):
+    """Create the room if it doesn't exist; cached so repeat visits skip the DB"""
+    with app.app_context(), draw_flush_lock:
+        if db.session.get(models.Room, room_id) is None:
+            db.session.add(models.Room(id=room_id))
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # Created concurrently by another request or worker
+                db.session.rollback()
+    return True
+
 @app.route('/room/<room_id>')
 def room(room_id):
-    # Create room if it doesn't exist
-    room = models.Room.query.get(room_id)
-    if not room:
-        room = models.Room(id=room_id)
-        db.session.add(room)
-        db.session.commit()
+    ensure_room(room_id)
     return render_template('room.html', room_id=room_id)
 
+def load_room_drawings(room_id):
+    """Load a room's drawings from the database and refill its cached list"""
+    cache_key = f"drawing_list:{room_id}"
+    with room_cache_lock(room_id):
+        # Persist queued strokes first so the refilled list can't miss them;
+        # strokes arriving later wait for the lock and RPUSHX onto the new list
+        while flush_draw_queue():
+            pass
+        # Strokes put back after a transient DB error aren't in the database yet
+        with draw_queue_lock:
+            pending = [d['data'] for d in draw_queue if d['room_id'] == room_id]
+        
+        drawing_data = []
+        cache_items = []
+        for drawing in models.DrawingData.for_room(room_id):
+            try:
+                path_obj = models.unpack_path(drawing.data)
+                drawing_data.append(path_obj)
+                cache_items.append(drawing.data)
+            except (TypeError, ValueError) as e:
+                logger.error(f"Error parsing drawing data: {e}")
+                continue
+        drawing_data.extend(models.unpack_path(data) for data in pending)
+        
+        # Update cache with fresh data, one list element per path; skipped while
+        # strokes are pending so the list is never missing them
+        if cache_items and not pending:
+            try:
+                pipe = cache.pipeline()
+                pipe.delete(cache_key)
+                pipe.rpush(cache_key, *cache_items)
+                pipe.expire(cache_key, 3600)
+                index_room_key(pipe, room_id, cache_key)
+                pipe.execute()
+            except redis.RedisError as e:
+                logger.error(f"Failed to refill drawing cache for room {room_id}: {e}")
+    return drawing_data
+
 @app.route('/room/<room_id>/drawings')
 def get_room_drawings(room_id):
     try:
         logger.info(f"Fetching drawings for room {room_id}")
         
         # Try to get from cache first
-        cache_key = f"drawing_data_{room_id}"
-        cached_data = cache.get(cache_key)
+        cache_key = f"drawing_list:{room_id}"
+        try:
+            cached_items = tracked_read('lrange', cache_key, 0, -1)
+        except redis.RedisError as e:
+            logger.error(f"Cache read failed, loading drawings from database: {e}")
+            cached_items = None
         
-        if cached_data:
+        if cached_items:
             logger.info("Retrieved drawings from cache")
-            return {"drawings": json.loads(cached_data)}
+            drawing_data = []
+            for item in cached_items:
+                try:
+                    drawing_data.append(models.unpack_path(item))
+                except (TypeError, ValueError) as e:
+                    logger.error(f"Error parsing cached drawing data: {e}")
+            return {"drawings": drawing_data}
         
         # If not in cache, get from database
-        drawings = models.DrawingData.query.filter_by(room_id=room_id).all()
-        drawing_data = []
-        
-        for drawing in drawings:
-            try:
-                path_obj = json.loads(drawing.data)
-                drawing_data.append(path_obj)
-            except json.JSONDecodeError as e:
-                logger.error(f"Error parsing drawing data: {e}")
-                continue
-        
-        # Update cache with fresh data
-        cache.setex(cache_key, 3600, json.dumps(drawing_data))
+        drawing_data = load_room_drawings(room_id)
         logger.info(f"Found {len(drawing_data)} drawings for room {room_id}")
         return {"drawings": drawing_data}
         
@@ -86,46 +519,38 @@ def get_room_drawings(room_id):
         logger.error(f"Error retrieving drawings: {e}")
         return {"drawings": [], "error": str(e)}
 
-# Room user count tracking
-room_users = {}
-
 @socketio.on('connect')
 def handle_connect():
+    ensure_db_ready()
     logger.info(f"Client connected: {request.sid}")
 
 @socketio.on('join')
 def handle_join(data):
     room = data['room']
     join_room(room)
+    local_room_sids[room].add(request.sid)
     
     try:
-        # Update user count with proper room tracking
-        if room not in room_users:
-            room_users[room] = set()
-        room_users[room].add(request.sid)
-        user_count = len(room_users[room])
-        
-        # Track user presence in Redis
+        # Track presence, cache room state, count the access and read back
+        # the active users in a single Redis round trip
         user_data = {
             'sid': request.sid,
             'joined_at': datetime.utcnow().isoformat(),
             'user_name': data.get('userName', 'Anonymous')
         }
-        track_user_presence(room, request.sid, user_data)
-        
-        # Cache room state
-        cache_room_state(room, {
-            'user_count': user_count,
+        access_count, active_users = record_room_join(room, request.sid, user_data, {
             'last_update': datetime.utcnow().isoformat()
         })
+        user_count = len(active_users)
+        start_background_once(presence_cleanup_worker)
         
         # Prefetch room data for frequently accessed rooms
-        prefetch_room_data(room)
+        prefetch_room_data(room, load_room_drawings, access_count)
         
         # Broadcast user count to all clients in room
         socketio.emit('user_joined', {
             'count': user_count,
-            'users': get_active_users(room)
+            'users': active_users
         }, room=room)
         
         logger.info(f"Client {request.sid} joined room {room}, total users: {user_count}")
@@ -133,55 +558,88 @@ def handle_join(data):
     except Exception as e:
         logger.error(f"Error in handle_join: {str(e)}")
         # Ensure basic functionality even if caching fails
-        socketio.emit('user_joined', {'count': len(room_users.get(room, set()))}, room=room)
+        socketio.emit('user_joined', {'count': len(get_active_users(room))}, room=room)
+
+def quantize_coord(value, precision=models.PATH_COORD_PRECISION):
+    """Round a coordinate, using an int when the result is whole"""
+    rounded = round(value, precision)
+    return int(rounded) if rounded == int(rounded) else rounded
+
+def quantize_path(path):
+    """Round a fabric.js path's command coordinates to 0.1px"""
+    # Object properties such as opacity or scale keep full precision
+    commands = path.get('path') if isinstance(path, dict) else None
+    if not isinstance(commands, list):
+        return path
+    return {
+        **path,
+        'path': [
+            [quantize_coord(v) if isinstance(v, float) else v for v in command]
+            if isinstance(command, list) else command
+            for command in commands
+        ]
+    }
 
 @socketio.on('draw')
 def handle_draw(data):
     room = data['room']
+    if not isinstance(room, str):
+        logger.error(f"Ignoring draw event with invalid room: {room!r}")
+        return
     try:
         logger.info(f"Received draw event for room {room}")
+        data['path'] = quantize_path(data['path'])
         
-        # Store in database with proper serialization
-        path_data = json.dumps(data['path'], separators=(',', ':'))
-        drawing = models.DrawingData(room_id=room, data=path_data)
-        db.session.add(drawing)
-        db.session.commit()
-        
-        # Update cache atomically
-        cache_key = f"drawing_data_{room}"
-        try:
-            cached_data = cache.get(cache_key)
-            drawing_list = json.loads(cached_data) if cached_data else []
-            drawing_list.append(data['path'])
-            cache.setex(cache_key, 3600, json.dumps(drawing_list, separators=(',', ':')))
-            logger.info(f"Successfully updated cache for room {room}")
-        except Exception as e:
-            logger.error(f"Cache update failed: {e}")
-        
-        # Broadcast to room
-        emit('draw_update', {
+        # Broadcast first so peers don't wait on persistence or caching
+        socketio.emit('draw_update', {
             'room': room,
             'path': data['path']
-        }, room=room, include_self=False)
+        }, to=room, skip_sid=request.sid)
         
+        # Queue for batched persistence as msgpack
+        path_data = models.pack_path(data['path'])
+        start_background_once(draw_flush_worker)
+        cache_key = f"drawing_list:{room}"
+        with room_cache_lock(room):
+            with draw_queue_lock:
+                draw_queue.append({
+                    'room_id': room,
+                    'data': path_data,
+                    'created_at': datetime.utcnow()
+                })
+            
+            # Append to the cached list; RPUSHX skips rooms not yet loaded into
+            # the cache so a cold cache is never mistaken for the full history.
+            # LTRIM keeps it to the same window a database load returns.
+            try:
+                (cache.pipeline()
+                    .rpushx(cache_key, path_data)
+                    .ltrim(cache_key, -models.MAX_ROOM_DRAWINGS, -1)
+                    .expire(cache_key, 3600)
+                    .execute())
+                logger.info(f"Successfully updated cache for room {room}")
+            except Exception as e:
+                logger.error(f"Cache update failed: {e}")
+        if len(draw_queue) >= DRAW_QUEUE_LIMIT:
+            flush_draw_queue()
     except Exception as e:
         logger.error(f"Error handling draw event: {e}")
-        db.session.rollback()
 
 @socketio.on('disconnect')
 def handle_disconnect():
-    # Update user count for all rooms user was in
-    for room in list(room_users.keys()):  # Use list to avoid runtime modification
-        if request.sid in room_users[room]:
-            room_users[room].remove(request.sid)
-            user_count = len(room_users[room])
-            socketio.emit('user_left', {'count': user_count}, room=room)
-            logger.info(f"Client {request.sid} left room {room}, remaining users: {user_count}")
-            
-            # Clean up empty rooms
-            if len(room_users[room]) == 0:
-                del room_users[room]
-                
+    # Update user count for the rooms this client is in (skipping its own sid room)
+    for room in rooms(sid=request.sid):
+        if room == request.sid:
+            continue
+        sids = local_room_sids.get(room)
+        if sids is not None:
+            sids.discard(request.sid)
+            if not sids:
+                del local_room_sids[room]
+        user_count = remove_user_presence(room, request.sid)
+        socketio.emit('user_left', {'count': user_count}, room=room)
+        logger.info(f"Client {request.sid} left room {room}, remaining users: {user_count}")
+    
     logger.info(f"Client disconnected: {request.sid}")
 
 @socketio.on('undo')
@@ -204,22 +662,16 @@ def handle_redo(data):
 def handle_cursor_move(data):
     room = data['room']
     try:
-        # Cache cursor position
+        # Buffer the latest position; the flush task caches and broadcasts it
         cursor_data = {
             'userName': data['userName'],
-            'x': data['x'],
-            'y': data['y'],
+            'x': int(round(data['x'])),  # Whole pixels are enough for cursors
+            'y': int(round(data['y'])),
             'timestamp': datetime.utcnow().isoformat()
         }
-        cache_cursor_position(room, request.sid, cursor_data)
-        
-        # Broadcast to room
-        emit('cursor_update', {
-            'room': room,
-            'userName': data['userName'],
-            'x': data['x'],
-            'y': data['y']
-        }, room=room, include_self=False)
+        start_background_once(cursor_flush_worker)
+        with cursor_buffer_lock:
+            cursor_buffer[(room, request.sid)] = cursor_data
     except Exception as e:
         logger.error(f"Error handling cursor move: {str(e)}")
 
@@ -242,13 +694,19 @@ def handle_viewport_update(data):
 def handle_clear(data):
     room = data['room']
     try:
-        # Clear cached drawing data
-        cache_key = f"drawing_data_{room}"
-        cache.delete(cache_key)
-        
-        # Clear drawings from database
-        models.DrawingData.query.filter_by(room_id=room).delete()
-        db.session.commit()
+        with room_cache_lock(room):
+            # Clear cached drawing data
+            cache_key = f"drawing_list:{room}"
+            cache.delete(cache_key)
+            
+            # Clear drawings from database, dropping any still queued for this room
+            with draw_flush_lock:
+                with draw_queue_lock:
+                    pending = [d for d in draw_queue if d['room_id'] != room]
+                    draw_queue.clear()
+                    draw_queue.extend(pending)
+                models.DrawingData.query.filter_by(room_id=room).delete()
+                db.session.commit()
         
         socketio.emit('clear_board', room=room, skip_sid=request.sid)
     except Exception as e:
@@ -1,6 +1,7 @@
 import redis
+from redis.cache import CacheConfig
 import logging
-import json
+import orjson
 import os
 from datetime import datetime
 from functools import wraps
@@ -14,7 +15,14 @@ BASE_BACKOFF = 0.1
 DRAWING_CACHE_TIMEOUT = 3600  # 1 hour
 ROOM_CACHE_TIMEOUT = 86400   # 24 hours
 USER_PRESENCE_TIMEOUT = 300  # 5 minutes
+CURSOR_TIMEOUT = 2           # 2 seconds
 PREFETCH_THRESHOLD = 10      # Number of accesses before prefetching
+ACCESS_PATTERN_TIMEOUT = 86400  # 24 hours
+PRESENCE_CLEANUP_INTERVAL = 60  # Seconds between stale presence sweeps
+# Max entries in the client-side cache. redis-py bounds entries, not bytes,
+# and one entry can be a whole room's drawing list (up to MAX_ROOM_DRAWINGS
+# paths, tens of MB worst case), so this stays small for the 256Mi pods.
+TRACKED_CACHE_SIZE = 4
 
 # Initialize Redis connection pool with optimized settings
 redis_pool = redis.ConnectionPool.from_url(
@@ -29,10 +37,66 @@ redis_pool = redis.ConnectionPool.from_url(
 
 redis_client = redis.Redis(connection_pool=redis_pool, decode_responses=True)
 
+# RESP3 client-side cache for read-mostly keys (drawing lists, room state).
+# Redis pushes invalidations when a tracked key changes, so local hits stay
+# fresh. Responses are not decoded since drawing lists hold msgpack bytes.
+# redis-py only allows this against Redis 7.4+ (not Valkey or older Redis);
+# tracked_read falls back to the plain clients below elsewhere.
+tracked_redis_pool = redis.ConnectionPool.from_url(
+    REDIS_URL,
+    max_connections=20,
+    socket_timeout=2,
+    socket_connect_timeout=2,
+    retry_on_timeout=True,
+    health_check_interval=30,
+    protocol=3,
+    cache_config=CacheConfig(max_size=TRACKED_CACHE_SIZE)
+)
+
+tracked_redis_client = redis.Redis(connection_pool=tracked_redis_pool)
+
+# Undecoded client for binary values when the tracked client can't be used
+binary_redis_pool = redis.ConnectionPool.from_url(
+    REDIS_URL,
+    max_connections=20,
+    socket_timeout=2,
+    socket_connect_timeout=2,
+    retry_on_timeout=True,
+    health_check_interval=30
+)
+
+binary_redis_client = redis.Redis(connection_pool=binary_redis_pool)
+
+TRACKING_RETRY_INTERVAL = 300  # Seconds before retrying the tracked client after a failure
+_tracking_disabled_until = 0
+
 def get_cache_key(base_key, version=CACHE_VERSION):
     """Generate versioned cache key"""
     return f"{base_key}:v{version}"
 
+def tracked_read(command, *args, fallback=binary_redis_client):
+    """Run a read command through the client-side cache, or through fallback
+
+    When the tracked client fails but the fallback works (e.g. the server is
+    older than Redis 7.4), tracking is skipped for TRACKING_RETRY_INTERVAL.
+    """
+    global _tracking_disabled_until
+    if time.time() >= _tracking_disabled_until:
+        try:
+            return getattr(tracked_redis_client, command)(*args)
+        except redis.RedisError as e:
+            result = getattr(fallback, command)(*args)
+            _tracking_disabled_until = time.time() + TRACKING_RETRY_INTERVAL
+            logging.warning(f"Client-side cache unavailable, using plain reads for {TRACKING_RETRY_INTERVAL}s: {e}")
+            return result
+    return getattr(fallback, command)(*args)
+
+def index_room_key(pipe, room_id, key):
+    """Queue registration of a room-scoped key so invalidation avoids KEYS"""
+    index_key = get_cache_key(f"room_keys_{room_id}")
+    pipe.sadd(index_key, key)
+    pipe.expire(index_key, ROOM_CACHE_TIMEOUT)
+
 def retry_with_backoff(func):
     """Enhanced retry decorator with exponential backoff and Redis-specific error handling"""
     @wraps(func)
@@ -108,48 +172,32 @@ def cache_drawing(timeout=300):
 
 def update_access_pattern(room_id):
     """Track room access patterns for prefetching"""
-    pattern_key = f"access_pattern:{room_id}"
+    count_key = f"access_count:{room_id}"
     try:
-        redis_client.set(
-            pattern_key,
-            {
-                'last_access': datetime.utcnow().isoformat(),
-                'access_count': redis_client.get(pattern_key, {}).get('access_count', 0) + 1
-            },
-            timeout=86400  # 24 hours
-        )
+        pipe = redis_client.pipeline()
+        pipe.incr(count_key)
+        pipe.expire(count_key, ACCESS_PATTERN_TIMEOUT)
+        pipe.set(f"last_access:{room_id}", datetime.utcnow().isoformat(), ex=ACCESS_PATTERN_TIMEOUT)
+        pipe.execute()
     except Exception as e:
         logging.warning(f"Failed to update access pattern: {str(e)}")
 
-def prefetch_room_data(room_id):
-    """Prefetch room data based on access patterns"""
-    pattern_key = f"access_pattern:{room_id}"
+def prefetch_room_data(room_id, load_drawings, access_count=None):
+    """Prefetch room data based on access patterns
+
+    ``load_drawings(room_id)`` refills the room's cached drawing list. An
+    access count already read by the caller (e.g. in the join pipeline) can
+    be passed in to skip the extra GET.
+    """
     try:
-        pattern = redis_client.get(pattern_key)
-        if pattern and pattern.get('access_count', 0) > PREFETCH_THRESHOLD:
-            # Room is frequently accessed, prefetch related data
+        if access_count is None:
+            access_count = int(redis_client.get(f"access_count:{room_id}") or 0)
+        cache_key = f"drawing_list:{room_id}"
+        if access_count > PREFETCH_THRESHOLD and not redis_client.exists(cache_key):
+            # Room is frequently accessed and not cached, prefetch related data
             logging.info(f"Prefetching data for frequently accessed room: {room_id}")
-            
-            # Prefetch drawing data
-            from models import DrawingData # Assumed this import is available
-            drawings = DrawingData.query.filter_by(room_id=room_id).all()
-            if drawings:
-                try:
-                    drawing_data = [json.loads(d.data) for d in drawings]
-                    cache_key = get_cache_key(f"drawing_data_{room_id}")
-                    
-                    @retry_with_backoff
-                    def cache_drawings():
-                        redis_client.setex(
-                            cache_key,
-                            DRAWING_CACHE_TIMEOUT,
-                            json.dumps(drawing_data, separators=(',', ':'))
-                        )
-                    
-                    cache_drawings()
-                    logging.info(f"Successfully prefetched {len(drawing_data)} drawings for room {room_id}")
-                except json.JSONDecodeError as e:
-                    logging.error(f"Error parsing drawing data during prefetch: {e}")
+            drawing_data = load_drawings(room_id)
+            logging.info(f"Successfully prefetched {len(drawing_data)} drawings for room {room_id}")
     except Exception as e:
         logging.warning(f"Failed to prefetch room data: {str(e)}")
 
@@ -158,11 +206,14 @@ def cache_room_state(room_id, state_data, timeout=ROOM_CACHE_TIMEOUT):
     """Cache room state including viewport and active users"""
     try:
         cache_key = get_cache_key(f"room_state_{room_id}")
-        redis_client.setex(
+        pipe = redis_client.pipeline()
+        pipe.setex(
             cache_key,
             timeout,
-            json.dumps(state_data, separators=(',', ':'))
+            orjson.dumps(state_data)
         )
+        index_room_key(pipe, room_id, cache_key)
+        pipe.execute()
         logging.info(f"Cached room state for room {room_id}")
     except Exception as e:
         logging.error(f"Failed to cache room state: {str(e)}")
@@ -172,51 +223,98 @@ def get_room_state(room_id):
     """Retrieve cached room state"""
     try:
         cache_key = get_cache_key(f"room_state_{room_id}")
-        data = redis_client.get(cache_key)
+        data = tracked_read('get', cache_key, fallback=redis_client)
         if data:
-            return json.loads(data)
+            return orjson.loads(data)
     except Exception as e:
         logging.error(f"Failed to get room state: {str(e)}")
     return None
 
-@retry_with_backoff
-def track_user_presence(room_id, user_id, user_data):
-    """Track user presence in a room with cursor position caching"""
+def record_room_join(room_id, user_id, user_data, state_data):
+    """Track presence, cache room state and read join-time data in one round trip
+
+    Each join also counts as a room access. Returns a tuple of
+    (access count, active users).
+    """
+    # Hot path: no retry decorator, failures are logged and dropped
     try:
         presence_key = get_cache_key(f"presence_{room_id}")
-        user_key = str(user_id)  # Ensure key is string
-        
-        # Add timestamp to user data for cleanup
+        state_key = get_cache_key(f"room_state_{room_id}")
         user_data['last_seen'] = datetime.utcnow().isoformat()
         
-        # Serialize user data
-        serialized_data = json.dumps(user_data)
-        
-        # Update user data in room with pipeline for atomicity
         pipe = redis_client.pipeline()
-        pipe.hset(presence_key, user_key, serialized_data)
+        pipe.hset(presence_key, str(user_id), orjson.dumps(user_data))
         pipe.expire(presence_key, USER_PRESENCE_TIMEOUT)
-        pipe.execute()
+        index_room_key(pipe, room_id, presence_key)
+        pipe.setex(state_key, ROOM_CACHE_TIMEOUT, orjson.dumps(state_data))
+        index_room_key(pipe, room_id, state_key)
+        # Registered here rather than on every cursor flush
+        index_room_key(pipe, room_id, get_cache_key(f"cursors_{room_id}"))
+        pipe.sadd(get_cache_key("active_rooms"), room_id)
+        count_key = f"access_count:{room_id}"
+        pipe.set(f"last_access:{room_id}", datetime.utcnow().isoformat(), ex=ACCESS_PATTERN_TIMEOUT)
+        pipe.incr(count_key)
+        pipe.expire(count_key, ACCESS_PATTERN_TIMEOUT)
+        pipe.hgetall(presence_key)
+        *_, access_count, _, user_hash = pipe.execute()
+        
+        return access_count, _decode_users(user_hash)
+    except Exception as e:
+        logging.error(f"Failed to record room join: {str(e)}")
+        return None, {}
+
+@retry_with_backoff
+def remove_user_presence(room_id, user_id):
+    """Remove a user's presence and cursor from a room, returning the remaining user count"""
+    try:
+        presence_key = get_cache_key(f"presence_{room_id}")
+        pipe = redis_client.pipeline()
+        pipe.hdel(presence_key, str(user_id))
+        pipe.hdel(get_cache_key(f"cursors_{room_id}"), str(user_id))
+        pipe.hlen(presence_key)
+        return pipe.execute()[-1]
+    except Exception as e:
+        logging.error(f"Failed to remove user presence: {str(e)}")
+        return 0
+
+@retry_with_backoff
+def refresh_user_presence(room_id, user_ids):
+    """Bump last_seen for users that are still connected"""
+    try:
+        presence_key = get_cache_key(f"presence_{room_id}")
+        user_ids = [str(user_id) for user_id in user_ids]
+        now = datetime.utcnow().isoformat()
         
-        logging.info(f"Updated presence for user {user_id} in room {room_id}")
+        updates = {}
+        for user_id, data in zip(user_ids, redis_client.hmget(presence_key, user_ids)):
+            if data:
+                user_data = orjson.loads(data)
+                user_data['last_seen'] = now
+                updates[user_id] = orjson.dumps(user_data)
         
-        # Cleanup disconnected users periodically
-        cleanup_disconnected_users(room_id)
+        if updates:
+            pipe = redis_client.pipeline()
+            pipe.hset(presence_key, mapping=updates)
+            pipe.expire(presence_key, USER_PRESENCE_TIMEOUT)
+            pipe.execute()
     except Exception as e:
-        logging.error(f"Failed to track user presence: {str(e)}")
+        logging.error(f"Failed to refresh user presence: {str(e)}")
+
+def _decode_users(user_data):
+    """Decode a presence hash into {user_id: user_data}"""
+    # Decode bytes to string if needed and parse JSON
+    return {
+        k.decode('utf-8') if isinstance(k, bytes) else k: 
+        orjson.loads(v)
+        for k, v in user_data.items()
+    }
 
 @retry_with_backoff
 def get_active_users(room_id):
     """Get all active users in a room"""
     try:
         presence_key = get_cache_key(f"presence_{room_id}")
-        user_data = redis_client.hgetall(presence_key)
-        # Decode bytes to string if needed and parse JSON
-        return {
-            k.decode('utf-8') if isinstance(k, bytes) else k: 
-            json.loads(v.decode('utf-8') if isinstance(v, bytes) else v)
-            for k, v in user_data.items()
-        }
+        return _decode_users(redis_client.hgetall(presence_key))
     except Exception as e:
         logging.error(f"Failed to get active users: {str(e)}")
         return {}
@@ -225,15 +323,16 @@ def get_active_users(room_id):
 def invalidate_room_cache(room_id):
     """Invalidate all cached data for a room"""
     try:
-        # Get all keys for the room
-        room_pattern = get_cache_key(f"*_{room_id}")
-        keys = redis_client.keys(room_pattern)
+        # Get all keys registered for the room
+        index_key = get_cache_key(f"room_keys_{room_id}")
+        keys = redis_client.smembers(index_key)
         
         if keys:
-            redis_client.delete(*keys)
+            redis_client.delete(*keys, index_key)
             logging.info(f"Invalidated cache for room {room_id}")
     except Exception as e:
         logging.error(f"Failed to invalidate room cache: {str(e)}")
+
 @retry_with_backoff
 def cleanup_disconnected_users(room_id):
     """Remove users who haven't updated their presence recently"""
@@ -251,48 +350,53 @@ def cleanup_disconnected_users(room_id):
     except Exception as e:
         logging.error(f"Failed to cleanup disconnected users: {str(e)}")
 
-@retry_with_backoff
-def cache_cursor_position(room_id, user_id, position_data, timeout=2):
-    """Cache cursor position with optimized connection handling"""
-    if not check_redis_connection():
-        logging.error("Redis connection is not available")
-        return
+def cleanup_inactive_rooms():
+    """Sweep stale presence entries for every room with recent joins"""
+    active_rooms_key = get_cache_key("active_rooms")
+    try:
+        for room_id in redis_client.smembers(active_rooms_key):
+            cleanup_disconnected_users(room_id)
+            if not redis_client.exists(get_cache_key(f"presence_{room_id}")):
+                redis_client.srem(active_rooms_key, room_id)
+    except Exception as e:
+        logging.error(f"Failed to cleanup inactive rooms: {str(e)}")
 
+def cache_cursor_positions(positions, timeout=CURSOR_TIMEOUT):
+    """Cache a batch of cursor positions keyed by (room_id, user_id) in one round trip"""
+    # Hot path: no retry decorator, failures are logged and dropped
     try:
-        cursor_key = get_cache_key(f"cursor_{room_id}_{user_id}")
+        now = time.time()
+        rooms = {}
+        for (room_id, user_id), position_data in positions.items():
+            rooms.setdefault(room_id, {})[str(user_id)] = orjson.dumps({**position_data, 'cached_at': now})
+        
         with redis_client.pipeline(transaction=False) as pipe:
-            try:
-                # Set cursor position with expiration
-                pipe.setex(cursor_key, timeout, json.dumps(position_data))
-                pipe.execute()
-                logging.debug(f"Successfully cached cursor position for user {user_id} in room {room_id}")
-            except redis.RedisError as e:
-                logging.error(f"Redis operation failed: {str(e)}")
-            except Exception as e:
-                logging.error(f"Unexpected error in cursor caching: {str(e)}")
+            for room_id, fields in rooms.items():
+                cursor_key = get_cache_key(f"cursors_{room_id}")
+                pipe.hset(cursor_key, mapping=fields)
+                pipe.expire(cursor_key, timeout)
+            pipe.execute()
     except Exception as e:
-        logging.error(f"Failed to cache cursor position: {str(e)}")
-    finally:
-        try:
-            # Safely release connection
-            if hasattr(redis_client, 'connection') and redis_client.connection:
-                redis_client.connection_pool.release(redis_client.connection)
-        except Exception as e:
-            logging.error(f"Error releasing Redis connection: {str(e)}")
+        logging.error(f"Failed to cache cursor positions: {str(e)}")
 
 @retry_with_backoff
-def get_cursor_positions(room_id):
+def get_cursor_positions(room_id, timeout=CURSOR_TIMEOUT):
     """Get all active cursor positions in a room"""
     try:
-        pattern = get_cache_key(f"cursor_{room_id}_*")
-        cursor_keys = redis_client.keys(pattern)
+        cursor_key = get_cache_key(f"cursors_{room_id}")
+        now = time.time()
         positions = {}
+        stale = []
         
-        for key in cursor_keys:
-            user_id = key.split('_')[-1]
-            data = redis_client.get(key)
-            if data:
-                positions[user_id] = json.loads(data)
+        for user_id, data in redis_client.hgetall(cursor_key).items():
+            position = orjson.loads(data)
+            if now - position.pop('cached_at', 0) > timeout:
+                stale.append(user_id)
+            else:
+                positions[user_id] = position
+        
+        if stale:
+            redis_client.hdel(cursor_key, *stale)
         return positions
     except Exception as e:
         logging.error(f"Failed to get cursor positions: {str(e)}")
@@ -1,5 +1,23 @@
+import os
+import orjson
 from flask_socketio import SocketIO
 from flask_sqlalchemy import SQLAlchemy
 
-socketio = SocketIO(async_handlers=True)
+# Redis message queue lets multiple workers broadcast to each other's clients
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+
+class OrjsonShim:
+    """json module stand-in backed by orjson for Socket.IO packet encoding"""
+
+    @staticmethod
+    def dumps(obj, *args, **kwargs):
+        # orjson output is always compact, separators are ignored
+        return orjson.dumps(obj).decode()
+
+    @staticmethod
+    def loads(s, *args, **kwargs):
+        return orjson.loads(s)
+
+socketio = SocketIO(async_handlers=True, async_mode='eventlet', message_queue=REDIS_URL,
+                    json=OrjsonShim)
 db = SQLAlchemy()
@@ -1,5 +1,10 @@
 from extensions import db
 from datetime import datetime
+import msgpack
+
+MAX_ROOM_DRAWINGS = 5000  # Most recent drawings loaded per room
+PATH_COORD_PRECISION = 1  # Decimal places kept for path coordinates (0.1px)
+PATH_COORD_SCALE = 10 ** PATH_COORD_PRECISION
 
 class Room(db.Model):
     id = db.Column(db.String(64), primary_key=True)
@@ -7,7 +12,61 @@ class Room(db.Model):
     last_active = db.Column(db.DateTime, default=datetime.utcnow)
 
 class DrawingData(db.Model):
+    # Composite index serves room lookups and chronological ordering
+    __table_args__ = (db.Index('ix_drawing_room_created', 'room_id', 'created_at'),)
+
     id = db.Column(db.Integer, primary_key=True)
     room_id = db.Column(db.String(64), db.ForeignKey('room.id'))
-    data = db.Column(db.Text)
+    data = db.Column(db.LargeBinary)  # msgpack-encoded path, see pack_path
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @classmethod
+    def for_room(cls, room_id, limit=MAX_ROOM_DRAWINGS):
+        """Stream a room's most recent drawings in chronological order"""
+        latest = (
+            db.select(cls.id)
+            .filter_by(room_id=room_id)
+            .order_by(cls.created_at.desc(), cls.id.desc())
+            .limit(limit)
+            .subquery()
+        )
+        return (
+            cls.query.filter(cls.id.in_(db.select(latest.c.id)))
+            .order_by(cls.created_at, cls.id)
+            .yield_per(500)
+        )
+
+def _map_path_coords(path, convert):
+    """Apply convert to the numbers in a fabric.js path's commands, or None if it has none"""
+    commands = path.get('path') if isinstance(path, dict) else None
+    if not isinstance(commands, list):
+        return None
+    return [
+        [convert(v) if isinstance(v, (int, float)) and not isinstance(v, bool) else v for v in command]
+        if isinstance(command, list) else command
+        for command in commands
+    ]
+
+def _from_fixed(value, scale):
+    """Convert a fixed-point coordinate back to a number, as an int when whole"""
+    value /= scale
+    return int(value) if value == int(value) else value
+
+def pack_path(path):
+    """Encode a drawing path as msgpack for the database and cache
+
+    Command coordinates are stored as fixed-point ints in PATH_COORD_SCALE
+    units, which msgpack packs in 1-3 bytes instead of a 9-byte float64.
+    """
+    commands = _map_path_coords(path, lambda v: int(round(v * PATH_COORD_SCALE)))
+    if commands is not None:
+        path = {**path, 'path': commands, '_coord_scale': PATH_COORD_SCALE}
+    return msgpack.packb(path, use_bin_type=True)
+
+def unpack_path(data):
+    """Decode a msgpack drawing path, restoring fixed-point coordinates"""
+    path = msgpack.unpackb(data, raw=False)
+    scale = path.pop('_coord_scale', None) if isinstance(path, dict) else None
+    if scale:
+        path['path'] = _map_path_coords(path, lambda v: _from_fixed(v, scale))
+    return path
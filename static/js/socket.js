@@ -67,9 +67,9 @@ class SocketManager {
     }
 
     on(event, callback) {
-        this.socket.on(event, (data) => {
+        this.socket.on(event, (...args) => {
             try {
-                callback(data);
+                callback(...args);
             } catch (error) {
                 console.error(`Error handling ${event} event:`, error);
             }
@@ -162,9 +162,10 @@ class Whiteboard {
             if (now - lastEmit > EMIT_INTERVAL) {
                 const pointer = this.canvas.getPointer(opt.e);
                 
-                // Ensure pointer coordinates are within canvas bounds
-                const x = Math.min(Math.max(pointer.x, 0), this.canvas.width);
-                const y = Math.min(Math.max(pointer.y, 0), this.canvas.height);
+                // Ensure pointer coordinates are within canvas bounds,
+                // rounded to whole pixels as the server does for cursors
+                const x = Math.round(Math.min(Math.max(pointer.x, 0), this.canvas.width));
+                const y = Math.round(Math.min(Math.max(pointer.y, 0), this.canvas.height));
                 
                 this.socket.emit('cursor_move', {
                     room: this.roomId,
@@ -176,10 +177,10 @@ class Whiteboard {
         });
 
         // Handle other users' cursors
-        this.socket.on('cursor_update', (data) => {
-            console.log('Received cursor update:', data);  // Debug log
-            if (data.room === this.roomId && data.userName !== this.socket.userName) {
-                this.updateCursor(data);
+        // Cursor updates arrive as positional (userName, x, y) arguments
+        this.socket.on('cursor_update', (userName, x, y) => {
+            if (userName !== this.socket.userName) {
+                this.updateCursor({ userName, x, y });
             }
         });
 